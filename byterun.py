@@ -1,37 +1,216 @@
-import collections
+import builtins
 import dis
+import functools
 import inspect
+import logging
 import operator
 import sys
 import types
 
+log = logging.getLogger(__name__)
+
 # -------------------------
-# Block Class
+# Blocks
 # -------------------------
-Block = collections.namedtuple("Block", "type, handler, stack_height")
+# Block stack entries are plain (type, handler, stack_height) tuples
+BLOCK_LOOP = 0
+BLOCK_EXCEPT_HANDLER = 1
+BLOCK_SETUP_EXCEPT = 2
+BLOCK_FINALLY = 3
+
+# Marker for fast locals that have not been assigned yet
+UNBOUND = object()
+
+# Opcodes the decoder and run loop treat specially
+CACHE = dis.opmap.get('CACHE', -1)
+EXTENDED_ARG = dis.opmap['EXTENDED_ARG']
+LOAD_CONST = dis.opmap['LOAD_CONST']
+LOAD_FAST = dis.opmap['LOAD_FAST']
+STORE_FAST = dis.opmap['STORE_FAST']
+POP_TOP = dis.opmap['POP_TOP']
+RETURN_VALUE = dis.opmap['RETURN_VALUE']
+BINARY_OP = dis.opmap.get('BINARY_OP', -1)
+LOAD_FAST_LOAD_FAST = dis.opmap.get('LOAD_FAST_LOAD_FAST', -1)
+RETURN_CONST = dis.opmap.get('RETURN_CONST', -1)
+
+# How parse_byte_and_args resolves each opcode's argument, decided once per
+# opcode number instead of by membership tests on every instruction
+(ARG_NONE, ARG_RAW, ARG_CONST, ARG_NAME, ARG_LOCAL, ARG_JUMP_FORWARD,
+ ARG_JUMP_BACKWARD, ARG_GLOBAL) = range(8)
+# Only real opcodes (below 256) can appear in co_code; from 3.12 the dis.has*
+# lists also carry compiler pseudo-opcodes numbered above them
+_ARG_KIND = [ARG_NONE] * dis.HAVE_ARGUMENT + [ARG_RAW] * (256 - dis.HAVE_ARGUMENT)
+for _op in dis.hasjrel:
+    if _op >= 256:
+        continue
+    if 'JUMP_BACKWARD' in dis.opname[_op]:
+        _ARG_KIND[_op] = ARG_JUMP_BACKWARD
+    else:
+        _ARG_KIND[_op] = ARG_JUMP_FORWARD
+for _op in dis.haslocal:
+    if _op < 256:
+        _ARG_KIND[_op] = ARG_LOCAL
+for _op in dis.hasname:
+    if _op < 256:
+        _ARG_KIND[_op] = ARG_NAME
+for _op in dis.hasconst:
+    if _op < 256:
+        _ARG_KIND[_op] = ARG_CONST
+del _op
+
+# From 3.11 LOAD_GLOBAL's low bit flags a NULL push; the name index is above it
+LOAD_GLOBAL = dis.opmap['LOAD_GLOBAL']
+if sys.version_info >= (3, 11):
+    _ARG_KIND[LOAD_GLOBAL] = ARG_GLOBAL
+
+# COMPARE_OP keeps its comparison in the high bits of the argument on 3.12+
+if sys.version_info >= (3, 13):
+    COMPARE_OP_SHIFT = 5
+elif sys.version_info >= (3, 12):
+    COMPARE_OP_SHIFT = 4
+else:
+    COMPARE_OP_SHIFT = 0
+COMPARE_OP = dis.opmap['COMPARE_OP']
+
+# From 3.12 an exhausted FOR_ITER skips the END_FOR at its target (and on
+# 3.13 the POP_TOP after it), so the decoder moves the target past them
+if sys.version_info >= (3, 13):
+    FOR_ITER_SKIP = 2
+elif sys.version_info >= (3, 12):
+    FOR_ITER_SKIP = 1
+else:
+    FOR_ITER_SKIP = 0
+FOR_ITER = dis.opmap['FOR_ITER']
+
+# Superinstructions fused by quicken(), numbered past the real opcodes.
+# LOAD_FAST__LOAD_FAST__OPERATOR covers a trailing BINARY_OP or COMPARE_OP.
+LOAD_FAST__LOAD_FAST__OPERATOR = 256
+LOAD_FAST__RETURN_VALUE = 257
+LOAD_CONST__RETURN_VALUE = 258
+# Jumps are rewritten to these kinds so run_frame can branch without a call
+JUMP = 259
+JUMP_IF_FALSE = 260
+JUMP_IF_TRUE = 261
+# dis.opname runs past 256 with pseudo-opcodes from 3.12, so cut it first
+OPNAMES = dis.opname[:256] + [
+    'LOAD_FAST__LOAD_FAST__OPERATOR',
+    'LOAD_FAST__RETURN_VALUE',
+    'LOAD_CONST__RETURN_VALUE',
+    'JUMP',
+    'POP_JUMP_IF_FALSE',
+    'POP_JUMP_IF_TRUE',
+]
+
+# BINARY_OP operators, indexed by the instruction's argument
+_BINOPS = (
+    operator.add,       # +
+    operator.and_,      # &
+    operator.floordiv,  # //
+    operator.lshift,    # <<
+    operator.matmul,    # @
+    operator.mul,       # *
+    operator.mod,       # %
+    operator.or_,       # |
+    operator.pow,       # **
+    operator.rshift,    # >>
+    operator.sub,       # -
+    operator.truediv,   # /
+    operator.xor,       # ^
+    operator.iadd,      # +=
+    operator.iand,      # &=
+    operator.ifloordiv, # //=
+    operator.ilshift,   # <<=
+    operator.imatmul,   # @=
+    operator.imul,      # *=
+    operator.imod,      # %=
+    operator.ior,       # |=
+    operator.ipow,      # **=
+    operator.irshift,   # >>=
+    operator.isub,      # -=
+    operator.itruediv,  # /=
+    operator.ixor,      # ^=
+)
+
+# Comparisons without an operator module equivalent
+def _contains(x, y):
+    return x in y
+
+def _not_contains(x, y):
+    return x not in y
+
+def _exception_match(x, y):
+    return issubclass(x, Exception) and issubclass(x, y)
+
+# Opcodes from other Python versions that share an existing handler. Jump
+# targets are already absolute by the time handlers run, so the direction
+# variants collapse onto one implementation.
+OPCODE_ALIASES = {
+    'JUMP_BACKWARD': 'JUMP_ABSOLUTE',
+    'JUMP_BACKWARD_NO_INTERRUPT': 'JUMP_ABSOLUTE',
+    'POP_JUMP_FORWARD_IF_TRUE': 'POP_JUMP_IF_TRUE',
+    'POP_JUMP_BACKWARD_IF_TRUE': 'POP_JUMP_IF_TRUE',
+    'POP_JUMP_FORWARD_IF_FALSE': 'POP_JUMP_IF_FALSE',
+    'POP_JUMP_BACKWARD_IF_FALSE': 'POP_JUMP_IF_FALSE',
+    'LOAD_FAST_CHECK': 'LOAD_FAST',
+}
+
+# Jump kinds for every opcode whose handler is a plain (conditional) jump
+_JUMP_KINDS = {}
+for _op, _name in enumerate(dis.opname[:256]):
+    _name = OPCODE_ALIASES.get(_name, _name)
+    if _name in ('JUMP_FORWARD', 'JUMP_ABSOLUTE'):
+        _JUMP_KINDS[_op] = JUMP
+    elif _name == 'POP_JUMP_IF_FALSE':
+        _JUMP_KINDS[_op] = JUMP_IF_FALSE
+    elif _name == 'POP_JUMP_IF_TRUE':
+        _JUMP_KINDS[_op] = JUMP_IF_TRUE
+del _op, _name
+
+# Finished VM-owned frames kept around for reuse by make_frame
+FRAME_POOL_SIZE = 64
 
 # -------------------------
 # Frame Class
 # -------------------------
 class Frame(object):
-    def __init__(self, code_obj, global_names, local_names, prev_frame):
+    def __init__(self, code_obj, global_names, local_names, prev_frame, builtin_names=None):
+        self.stack = []
+        self.block_stack = []
+        # Set by VirtualMachine.make_frame for frames it may recycle
+        self.pooled = False
+        self.reset(code_obj, global_names, local_names, prev_frame, builtin_names)
+
+    def reset(self, code_obj, global_names, local_names, prev_frame, builtin_names=None):
+        # Also used to recycle pooled frames, so keep the existing stacks
         self.code_obj = code_obj
         self.global_names = global_names
         self.local_names = local_names
         self.prev_frame = prev_frame
-        self.stack = []
-        self.block_stack = []
         self.last_instruction = 0
+        self.fastlocals = [UNBOUND] * len(code_obj.co_varnames)
 
         if prev_frame:
             self.builtin_names = prev_frame.builtin_names
+        elif builtin_names is not None:
+            self.builtin_names = builtin_names
         else:
             self.builtin_names = local_names['__builtins__']
             if hasattr(self.builtin_names, '__dict__'):
                 self.builtin_names = self.builtin_names.__dict__
 
+    def clear(self):
+        # Drop references held by a finished frame before it is pooled
+        self.stack.clear()
+        self.block_stack.clear()
+        self.global_names = self.local_names = self.prev_frame = None
+        self.builtin_names = self.fastlocals = None
+
     @property
     def f_locals(self):
+        # Fast locals live in an array; only sync them into the dict on demand
+        for name, val in zip(self.code_obj.co_varnames, self.fastlocals):
+            if val is not UNBOUND:
+                self.local_names[name] = val
         return self.local_names
 
     @property
@@ -46,15 +225,14 @@ class Frame(object):
 # Function Class
 # -------------------------
 def make_cell(value):
-    fn = (lambda x: lambda: x)(value)
-    return fn.__closure__[0]
+    return types.CellType(value)
 
 class Function(object):
     __slots__ = [
         'func_code', 'func_name', 'func_defaults', 'func_globals',
         'func_locals', 'func_dict', 'func_closure',
         '__name__', '__dict__', '__doc__',
-        '_vm', '_func',
+        '_vm', '_func', '_argcount',
     ]
 
     def __init__(self, name, code, globs, defaults, closure, vm):
@@ -63,93 +241,141 @@ class Function(object):
         self.func_name = self.__name__ = name or code.co_name
         self.func_defaults = tuple(defaults)
         self.func_globals = globs
-        self.func_locals = self._vm.frame.f_locals
+        # Functions can also be built by the host, outside any running frame
+        self.func_locals = vm.frame.f_locals if vm.frame else {}
         self.__dict__ = {}
         self.func_closure = closure
         self.__doc__ = code.co_consts[0] if code.co_consts else None
+        # Built on first use; only calls that need getcallargs look at it
+        self._func = None
 
-        kw = {'argdefs': self.func_defaults}
-        if closure:
-            kw['closure'] = tuple(make_cell(0) for _ in closure)
-        self._func = types.FunctionType(code, globs, **kw)
+        # Positional argument count for calls that can skip getcallargs,
+        # or -1 when the signature needs full binding
+        if code.co_kwonlyargcount or code.co_flags & (inspect.CO_VARARGS | inspect.CO_VARKEYWORDS):
+            self._argcount = -1
+        else:
+            self._argcount = code.co_argcount
 
     def __call__(self, *args, **kwargs):
-        callargs = inspect.getcallargs(self._func, *args, **kwargs)
-        frame = self._vm.make_frame(self.func_code, callargs, self.func_globals, {})
+        if not kwargs and len(args) == self._argcount:
+            # Positional arguments occupy the first fast locals in order
+            frame = self._vm.make_frame(self.func_code, {}, self.func_globals, {}, pooled=True)
+            frame.fastlocals[:self._argcount] = args
+        else:
+            if self._func is None:
+                kw = {'argdefs': self.func_defaults}
+                if self.func_closure:
+                    kw['closure'] = tuple(make_cell(0) for _ in self.func_closure)
+                self._func = types.FunctionType(self.func_code, self.func_globals, **kw)
+            callargs = inspect.getcallargs(self._func, *args, **kwargs)
+            frame = self._vm.make_frame(self.func_code, callargs, self.func_globals, {}, pooled=True)
         return self._vm.run_frame(frame)
 
 # -------------------------
 # Virtual Machine
 # -------------------------
+# Operators for the legacy BINARY_* opcodes, keyed by the opcode suffix
+_BINARY_OPERATORS = {
+    'POWER':    pow,
+    'MULTIPLY': operator.mul,
+    'FLOOR_DIVIDE': operator.floordiv,
+    'TRUE_DIVIDE':  operator.truediv,
+    'MODULO':   operator.mod,
+    'ADD':      operator.add,
+    'SUBTRACT': operator.sub,
+    'SUBSCR':   operator.getitem,
+    'LSHIFT':   operator.lshift,
+    'RSHIFT':   operator.rshift,
+    'AND':      operator.and_,
+    'XOR':      operator.xor,
+    'OR':       operator.or_,
+}
+
+# COMPARE_OP comparisons, indexed by the comparison number
+_COMPARE_OPERATORS = (
+    operator.lt,
+    operator.le,
+    operator.eq,
+    operator.ne,
+    operator.gt,
+    operator.ge,
+    _contains,
+    _not_contains,
+    operator.is_,
+    operator.is_not,
+    _exception_match,
+)
+
 class VirtualMachineError(Exception):
     pass
 
 class VirtualMachine(object):
-    BINARY_OPERATORS = {
-        'POWER':    pow,
-        'MULTIPLY': operator.mul,
-        'FLOOR_DIVIDE': operator.floordiv,
-        'TRUE_DIVIDE':  operator.truediv,
-        'MODULO':   operator.mod,
-        'ADD':      operator.add,
-        'SUBTRACT': operator.sub,
-        'SUBSCR':   operator.getitem,
-        'LSHIFT':   operator.lshift,
-        'RSHIFT':   operator.rshift,
-        'AND':      operator.and_,
-        'XOR':      operator.xor,
-        'OR':       operator.or_,
-    }
-
-    COMPARE_OPERATORS = [
-        operator.lt,
-        operator.le,
-        operator.eq,
-        operator.ne,
-        operator.gt,
-        operator.ge,
-        lambda x, y: x in y,
-        lambda x, y: x not in y,
-        lambda x, y: x is y,
-        lambda x, y: x is not y,
-        lambda x, y: issubclass(x, Exception) and issubclass(x, y),
-    ]
+    BINARY_OPERATORS = _BINARY_OPERATORS
+    COMPARE_OPERATORS = _COMPARE_OPERATORS
 
     def __init__(self):
         self.frames = []
         self.frame = None
         self.return_value = None
         self.last_exception = None
+        self._quicken_cache = {}
+        self._frame_pool = []
+        # Unsupported opcodes already reported, so each is warned about once
+        self._unsupported_opcodes = set()
+        self._default_globals = {
+            '__builtins__': __builtins__,
+            '__name__': '__main__',
+            '__doc__': None,
+            '__package__': None,
+        }
+        self._builtins_dict = builtins.__dict__
+        self._dispatch = self.build_dispatch_table()
 
     # -------------------------
     # Frame manipulation
     # -------------------------
-    def make_frame(self, code, callargs={}, global_names=None, local_names=None):
+    def make_frame(self, code, callargs={}, global_names=None, local_names=None, pooled=False):
+        # pooled=True is only for frames the VM owns outright (run_code and
+        # Function calls); pop_frame recycles those once they finish
         if global_names is None and local_names is None:
             if self.frames:
                 global_names = self.frame.global_names
                 local_names = {}
             else:
-                global_names = local_names = {
-                    '__builtins__': __builtins__,
-                    '__name__': '__main__',
-                    '__doc__': None,
-                    '__package__': None,
-                }
+                # Copied because module-level code stores its names here
+                global_names = local_names = self._default_globals.copy()
         elif global_names is not None and local_names is None:
             local_names = {}
         elif local_names is not None and global_names is None:
             global_names = local_names
-            
-        # Ensure local_names has required builtins if it doesn't already
-        if '__builtins__' not in local_names:
-            if global_names and '__builtins__' in global_names:
-                local_names['__builtins__'] = global_names['__builtins__']
+
+        # Frames called from another frame inherit its builtins; only a
+        # top-level frame needs to find them through its namespaces
+        builtin_names = None
+        if self.frame is None:
+            if '__builtins__' not in local_names:
+                if global_names and '__builtins__' in global_names:
+                    local_names['__builtins__'] = global_names['__builtins__']
+                else:
+                    local_names['__builtins__'] = __builtins__
+            # Either form of the standard builtins can be found here: a
+            # module's globals hold the dict, __main__'s hold the module
+            frame_builtins = local_names['__builtins__']
+            if frame_builtins is builtins or frame_builtins is self._builtins_dict:
+                builtin_names = self._builtins_dict
+
+        if pooled and self._frame_pool:
+            frame = self._frame_pool.pop()
+            frame.reset(code, global_names, local_names, self.frame, builtin_names)
+        else:
+            frame = Frame(code, global_names, local_names, self.frame, builtin_names)
+        frame.pooled = pooled
+        varnames = code.co_varnames
+        for name, val in callargs.items():
+            if name in varnames:
+                frame.fastlocals[varnames.index(name)] = val
             else:
-                local_names['__builtins__'] = __builtins__
-        
-        local_names.update(callargs)
-        frame = Frame(code, global_names, local_names, self.frame)
+                local_names[name] = val
         return frame
 
     def push_frame(self, frame):
@@ -157,11 +383,14 @@ class VirtualMachine(object):
         self.frame = frame
 
     def pop_frame(self):
-        self.frames.pop()
+        frame = self.frames.pop()
         if self.frames:
             self.frame = self.frames[-1]
         else:
             self.frame = None
+        if frame.pooled and len(self._frame_pool) < FRAME_POOL_SIZE:
+            frame.clear()
+            self._frame_pool.append(frame)
 
     # -------------------------
     # Data stack manipulation
@@ -175,10 +404,17 @@ class VirtualMachine(object):
     def push(self, *vals):
         self.frame.stack.extend(vals)
 
+    def pop2(self):
+        stack = self.frame.stack
+        y = stack.pop()
+        x = stack.pop()
+        return x, y
+
     def popn(self, n):
         if n:
-            ret = self.frame.stack[-n:]
-            self.frame.stack[-n:] = []
+            stack = self.frame.stack
+            ret = stack[-n:]
+            del stack[-n:]
             return ret
         else:
             return []
@@ -188,23 +424,27 @@ class VirtualMachine(object):
     # -------------------------
     def push_block(self, b_type, handler=None):
         stack_height = len(self.frame.stack)
-        self.frame.block_stack.append(Block(b_type, handler, stack_height))
+        self.frame.block_stack.append((b_type, handler, stack_height))
 
     def pop_block(self):
         return self.frame.block_stack.pop()
 
     def unwind_block(self, block):
-        offset = 3 if block.type == 'except-handler' else 0
-        while len(self.frame.stack) > block.stack_height + offset:
+        b_type, handler, stack_height = block
+        offset = 3 if b_type == BLOCK_EXCEPT_HANDLER else 0
+        while len(self.frame.stack) > stack_height + offset:
             self.pop()
-        if block.type == 'except-handler':
-            traceback, value, exctype = self.popn(3)
+        if b_type == BLOCK_EXCEPT_HANDLER:
+            exctype = self.pop()
+            value = self.pop()
+            traceback = self.pop()
             self.last_exception = exctype, value, traceback
 
     def manage_block_stack(self, why):
         frame = self.frame
         block = frame.block_stack[-1]
-        if block.type == 'loop' and why == 'continue':
+        b_type, handler, stack_height = block
+        if b_type == BLOCK_LOOP and why == 'continue':
             self.jump(self.return_value)
             why = None
             return why
@@ -212,125 +452,287 @@ class VirtualMachine(object):
         self.pop_block()
         self.unwind_block(block)
 
-        if block.type == 'loop' and why == 'break':
+        if b_type == BLOCK_LOOP and why == 'break':
             why = None
-            self.jump(block.handler)
+            self.jump(handler)
             return why
 
-        if (block.type in ['setup-except', 'finally'] and why == 'exception'):
-            self.push_block('except-handler')
+        if (b_type == BLOCK_SETUP_EXCEPT or b_type == BLOCK_FINALLY) and why == 'exception':
+            self.push_block(BLOCK_EXCEPT_HANDLER)
             exctype, value, tb = self.last_exception
             self.push(tb, value, exctype)
             self.push(tb, value, exctype)
             why = None
-            self.jump(block.handler)
+            self.jump(handler)
             return why
 
-        elif block.type == 'finally':
+        elif b_type == BLOCK_FINALLY:
             if why in ('return', 'continue'):
                 self.push(self.return_value)
             self.push(why)
             why = None
-            self.jump(block.handler)
+            self.jump(handler)
             return why
         return why
 
     # -------------------------
     # Bytecode helpers
     # -------------------------
-    def parse_byte_and_args(self):
-        f = self.frame
-        opoffset = f.last_instruction
-        
-        # Handle end of bytecode
-        if opoffset >= len(f.code_obj.co_code):
-            return 'RETURN_VALUE', []
-            
-        byteCode = f.code_obj.co_code[opoffset]
-        f.last_instruction += 1
-        byte_name = dis.opname[byteCode]
-        
-        if byteCode >= dis.HAVE_ARGUMENT:
-            if f.last_instruction + 1 >= len(f.code_obj.co_code):
-                return byte_name, [0]
-                
-            arg_bytes = f.code_obj.co_code[f.last_instruction:f.last_instruction+2]
-            f.last_instruction += 2
-            arg_val = arg_bytes[0] | (arg_bytes[1] << 8)
-            
-            if byteCode in dis.hasconst:
-                if arg_val < len(f.code_obj.co_consts):
-                    arg = f.code_obj.co_consts[arg_val]
+    def parse_byte_and_args(self, code_obj):
+        # Wordcode is (opcode, arg) byte pairs; split the two streams once and
+        # walk them in step
+        co_code = code_obj.co_code
+        opcodes = co_code[0::2]
+        opargs = co_code[1::2]
+        n = len(opcodes)
+
+        # Inline CACHE entries belong to the instruction before them, so each
+        # instruction continues at the next non-CACHE word
+        next_pcs = [n] * n
+        next_pc = n
+        for pc in range(n - 1, -1, -1):
+            next_pcs[pc] = next_pc
+            if opcodes[pc] != CACHE:
+                next_pc = pc
+
+        consts = code_obj.co_consts
+        names = code_obj.co_names
+        extended_arg = 0
+        for pc, (byteCode, arg_val) in enumerate(zip(opcodes, opargs)):
+            arg_val |= extended_arg
+            next_pc = next_pcs[pc]
+            extended_arg = arg_val << 8 if byteCode == EXTENDED_ARG else 0
+
+            kind = _ARG_KIND[byteCode]
+            if kind == ARG_NONE:
+                argument = ()
+            elif kind == ARG_RAW or kind == ARG_LOCAL:
+                argument = (arg_val,)
+            elif kind == ARG_CONST:
+                if arg_val < len(consts):
+                    argument = (consts[arg_val],)
                 else:
-                    arg = None
-            elif byteCode in dis.hasname:
-                if arg_val < len(f.code_obj.co_names):
-                    arg = f.code_obj.co_names[arg_val]
+                    argument = (None,)
+            elif kind == ARG_NAME:
+                if arg_val < len(names):
+                    argument = (names[arg_val],)
                 else:
-                    arg = arg_val
-            elif byteCode in dis.haslocal:
-                if arg_val < len(f.code_obj.co_varnames):
-                    arg = f.code_obj.co_varnames[arg_val]
+                    argument = (arg_val,)
+            elif kind == ARG_GLOBAL:
+                # The NULL is not modelled; CALL only pops the callable
+                if arg_val >> 1 < len(names):
+                    argument = (names[arg_val >> 1],)
                 else:
-                    arg = arg_val
-            elif byteCode in dis.hasjrel:
-                arg = f.last_instruction + arg_val
+                    argument = (arg_val,)
+            elif kind == ARG_JUMP_FORWARD:
+                target = next_pc + arg_val
+                if byteCode == FOR_ITER:
+                    for _ in range(FOR_ITER_SKIP):
+                        target = next_pcs[target]
+                argument = (target,)
             else:
-                arg = arg_val
-            argument = [arg]
-        else:
-            argument = []
-            
-        return byte_name, argument
+                argument = (next_pc - arg_val,)
 
-    def dispatch(self, byte_name, argument):
-        why = None
-        try:
-            # Special handling for opcode 1 which should be LOAD_FAST_LOAD_FAST
-            if byte_name == 'BEFORE_ASYNC_WITH' and len(argument) == 0:
-                # This is likely a misidentified LOAD_FAST_LOAD_FAST
-                print("Converting BEFORE_ASYNC_WITH to LOAD_FAST_LOAD_FAST")
-                return self.byte_LOAD_FAST_LOAD_FAST(1)
-                
-            bytecode_fn = getattr(self, 'byte_%s' % byte_name, None)
+            yield pc, byteCode, argument, next_pc
+
+    def build_dispatch_table(self):
+        """Map every opcode number to its bound handler, or None if unsupported."""
+        table = []
+        for byteCode in range(256):
+            byte_name = dis.opname[byteCode]
+            byte_name = OPCODE_ALIASES.get(byte_name, byte_name)
+            bytecode_fn = getattr(self, 'byte_' + byte_name, None)
             if bytecode_fn is None:
                 if byte_name.startswith('UNARY_'):
-                    self.unaryOperator(byte_name[6:])
+                    bytecode_fn = functools.partial(self.unaryOperator, byte_name[6:])
                 elif byte_name.startswith('BINARY_'):
-                    self.binaryOperator(byte_name[7:])
+                    bytecode_fn = functools.partial(self.binaryOperator, byte_name[7:])
+            table.append(bytecode_fn)
+        return table
+
+    def quicken(self, code_obj):
+        """Decode a code object once into a list of
+        (opcode, arg, handler, argument, next_pc) entries.
+
+        The list is indexed by instruction number (byte offset // 2), so jump
+        targets index straight into it. Results are cached per code object.
+        """
+        instructions = self._quicken_cache.get(code_obj)
+        if instructions is not None:
+            return instructions
+
+        instructions = []
+        for pc, byteCode, argument, next_pc in self.parse_byte_and_args(code_obj):
+            byte_name = dis.opname[byteCode]
+            bytecode_fn = self._dispatch[byteCode]
+            if bytecode_fn is None:
+                if byteCode not in self._unsupported_opcodes:
+                    self._unsupported_opcodes.add(byteCode)
+                    log.warning("Unsupported bytecode %s, ignoring...", byte_name)
+                bytecode_fn = self.byte_NOP
+            arg = argument[0] if argument else None
+            if byteCode == BINARY_OP:
+                # The operator is fixed per instruction, so resolve it now
+                if arg >= len(_BINOPS):
+                    raise VirtualMachineError(f"Unknown binary operation: {arg}")
+                arg = _BINOPS[arg]
+            elif byteCode == COMPARE_OP:
+                if arg >> COMPARE_OP_SHIFT >= len(_COMPARE_OPERATORS):
+                    raise VirtualMachineError(f"Unknown comparison: {arg}")
+                arg = _COMPARE_OPERATORS[arg >> COMPARE_OP_SHIFT]
+            elif byteCode == LOAD_FAST_LOAD_FAST:
+                # Both local indices are packed into the argument
+                arg = (arg >> 4, arg & 15)
+            elif byteCode == RETURN_CONST:
+                # 3.12+ spells LOAD_CONST, RETURN_VALUE as one instruction
+                byteCode = LOAD_CONST__RETURN_VALUE
+            elif byteCode in _JUMP_KINDS:
+                # Targets are already resolved to instruction indices
+                byteCode = _JUMP_KINDS[byteCode]
+            instructions.append((byteCode, arg, bytecode_fn, argument, next_pc))
+
+        # Running off the end of the code behaves like a bare return
+        instructions.append((RETURN_VALUE, None, self.byte_RETURN_VALUE, (), len(instructions)))
+        self.fuse_superinstructions(instructions)
+
+        self._quicken_cache[code_obj] = instructions
+        return instructions
+
+    def fuse_superinstructions(self, instructions):
+        """Peephole-fuse common instruction sequences in place.
+
+        Only the first entry of a sequence is replaced, so a jump into the
+        middle of it still runs the original instructions.
+        """
+        for pc, (byteCode, arg, bytecode_fn, argument, next_pc) in enumerate(instructions):
+            if byteCode == LOAD_FAST_LOAD_FAST:
+                # 3.13+ already pairs the loads; only the operator is left
+                second = instructions[next_pc]
+                if second[0] == BINARY_OP or second[0] == COMPARE_OP:
+                    instructions[pc] = (LOAD_FAST__LOAD_FAST__OPERATOR,
+                                        arg + (second[1],),
+                                        self.byte_LOAD_FAST, argument, second[4])
+                continue
+            if byteCode != LOAD_FAST and byteCode != LOAD_CONST:
+                continue
+            second = instructions[next_pc]
+            if second[0] == RETURN_VALUE:
+                if byteCode == LOAD_FAST:
+                    kind = LOAD_FAST__RETURN_VALUE
                 else:
-                    print(f"Warning: Unsupported bytecode {byte_name}, ignoring...")
-            else:
-                why = bytecode_fn(*argument)
-        except Exception as e:
-            print(f"Error executing {byte_name}: {e}")
-            self.last_exception = sys.exc_info()[:2] + (None,)
-            why = 'exception'
-        return why
+                    kind = LOAD_CONST__RETURN_VALUE
+                instructions[pc] = (kind, arg, bytecode_fn, argument, second[4])
+            elif byteCode == LOAD_FAST and second[0] == LOAD_FAST:
+                third = instructions[second[4]]
+                if third[0] == BINARY_OP or third[0] == COMPARE_OP:
+                    instructions[pc] = (LOAD_FAST__LOAD_FAST__OPERATOR,
+                                        (arg, second[1], third[1]),
+                                        bytecode_fn, argument, third[4])
 
     # -------------------------
     # Execution
     # -------------------------
     def run_code(self, code, callargs={}, global_names=None, local_names=None):
-        frame = self.make_frame(code, callargs=callargs, global_names=global_names, local_names=local_names)
+        frame = self.make_frame(code, callargs=callargs, global_names=global_names,
+                                local_names=local_names, pooled=True)
         return self.run_frame(frame)
 
     def run_frame(self, frame):
+        # Decode first: a malformed code object raises here before the frame
+        # is pushed, leaving the VM's frame stack untouched
+        instructions = self.quicken(frame.code_obj)
         self.push_frame(frame)
-        instruction_count = 0
+        # Hot state lives in locals; the most common opcodes are handled
+        # inline and everything else goes through its byte_* handler
+        stack = frame.stack
+        fastlocals = frame.fastlocals
+        global_names = frame.global_names
+        builtin_names = frame.builtin_names
         while True:
-            byte_name, arguments = self.parse_byte_and_args()
-            why = self.dispatch(byte_name, arguments)
+            pc = frame.last_instruction
+            why = None
+            try:
+                while True:
+                    byteCode, arg, bytecode_fn, argument, pc = instructions[pc]
+                    if byteCode == LOAD_FAST:
+                        val = fastlocals[arg]
+                        if val is UNBOUND:
+                            bytecode_fn(arg)
+                        stack.append(val)
+                    elif byteCode == LOAD_CONST:
+                        stack.append(arg)
+                    elif byteCode == STORE_FAST:
+                        fastlocals[arg] = stack.pop()
+                    elif byteCode == JUMP:
+                        pc = arg
+                    elif byteCode == JUMP_IF_FALSE:
+                        if not stack.pop():
+                            pc = arg
+                    elif byteCode == JUMP_IF_TRUE:
+                        if stack.pop():
+                            pc = arg
+                    elif byteCode == LOAD_GLOBAL:
+                        val = global_names.get(arg, UNBOUND)
+                        if val is UNBOUND:
+                            val = builtin_names.get(arg, UNBOUND)
+                            if val is UNBOUND:
+                                bytecode_fn(arg)
+                        stack.append(val)
+                    elif byteCode == BINARY_OP or byteCode == COMPARE_OP:
+                        y = stack.pop()
+                        stack[-1] = arg(stack[-1], y)
+                    elif byteCode == POP_TOP:
+                        stack.pop()
+                    elif byteCode == RETURN_VALUE:
+                        self.return_value = stack.pop() if stack else None
+                        why = 'return'
+                        break
+                    elif byteCode == LOAD_FAST__LOAD_FAST__OPERATOR:
+                        i, j, op = arg
+                        x = fastlocals[i]
+                        y = fastlocals[j]
+                        if x is UNBOUND:
+                            bytecode_fn(i)
+                        if y is UNBOUND:
+                            bytecode_fn(j)
+                        stack.append(op(x, y))
+                    elif byteCode == LOAD_FAST_LOAD_FAST:
+                        i, j = arg
+                        x = fastlocals[i]
+                        y = fastlocals[j]
+                        if x is UNBOUND or y is UNBOUND:
+                            bytecode_fn(*argument)
+                        stack.append(x)
+                        stack.append(y)
+                    elif byteCode == LOAD_FAST__RETURN_VALUE:
+                        val = fastlocals[arg]
+                        if val is UNBOUND:
+                            bytecode_fn(arg)
+                        self.return_value = val
+                        why = 'return'
+                        break
+                    elif byteCode == LOAD_CONST__RETURN_VALUE:
+                        self.return_value = arg
+                        why = 'return'
+                        break
+                    else:
+                        frame.last_instruction = pc
+                        why = bytecode_fn(*argument)
+                        pc = frame.last_instruction
+                        if why:
+                            break
+            except Exception as e:
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("Error executing %s: %s", OPNAMES[byteCode], e)
+                self.last_exception = sys.exc_info()[:2] + (None,)
+                why = 'exception'
+            frame.last_instruction = pc
 
             while why and frame.block_stack:
                 why = self.manage_block_stack(why)
 
             if why:
                 break
-                
-            instruction_count += 1
-            if instruction_count > 100:
-                break
 
         self.pop_frame()
 
@@ -352,8 +754,8 @@ class VirtualMachine(object):
     # Operators
     # -------------------------
     def binaryOperator(self, op):
-        x, y = self.popn(2)
-        self.push(self.BINARY_OPERATORS[op](x, y))
+        x, y = self.pop2()
+        self.push(_BINARY_OPERATORS[op](x, y))
 
     def unaryOperator(self, op):
         x = self.pop()
@@ -369,8 +771,8 @@ class VirtualMachine(object):
             raise VirtualMachineError("Unknown unary operator: %s" % op)
 
     def byte_COMPARE_OP(self, opnum):
-        x, y = self.popn(2)
-        self.push(self.COMPARE_OPERATORS[opnum](x, y))
+        x, y = self.pop2()
+        self.push(_COMPARE_OPERATORS[opnum >> COMPARE_OP_SHIFT](x, y))
 
     # -------------------------
     # Stack manipulation instructions
@@ -399,24 +801,23 @@ class VirtualMachine(object):
     def byte_STORE_NAME(self, name):
         self.frame.f_locals[name] = self.pop()
 
-    def byte_LOAD_FAST(self, name):
-        if name in self.frame.f_locals:
-            val = self.frame.f_locals[name]
-        else:
+    def byte_LOAD_FAST(self, idx):
+        val = self.frame.fastlocals[idx]
+        if val is UNBOUND:
+            name = self.frame.code_obj.co_varnames[idx]
             raise UnboundLocalError("local variable '%s' referenced before assignment" % name)
         self.push(val)
 
-    def byte_STORE_FAST(self, name):
-        self.frame.f_locals[name] = self.pop()
+    def byte_STORE_FAST(self, idx):
+        self.frame.fastlocals[idx] = self.pop()
 
     def byte_LOAD_GLOBAL(self, name):
         f = self.frame
-        if name in f.f_globals:
-            val = f.f_globals[name]
-        elif name in f.f_builtins:
-            val = f.f_builtins[name]
-        else:
-            raise NameError("global name '%s' is not defined" % name)
+        val = f.f_globals.get(name, UNBOUND)
+        if val is UNBOUND:
+            val = f.f_builtins.get(name, UNBOUND)
+            if val is UNBOUND:
+                raise NameError("global name '%s' is not defined" % name)
         self.push(val)
 
     # -------------------------
@@ -428,7 +829,7 @@ class VirtualMachine(object):
         self.push(val)
 
     def byte_STORE_ATTR(self, name):
-        val, obj = self.popn(2)
+        val, obj = self.pop2()
         setattr(obj, name, val)
 
     # -------------------------
@@ -442,9 +843,11 @@ class VirtualMachine(object):
         self.push({})
 
     def byte_STORE_MAP(self):
-        the_map, val, key = self.popn(3)
-        the_map[key] = val
-        self.push(the_map)
+        # The map stays on the stack, so update it in place
+        stack = self.frame.stack
+        key = stack.pop()
+        val = stack.pop()
+        stack[-1][key] = val
 
     def byte_LIST_APPEND(self, count):
         val = self.pop()
@@ -454,6 +857,8 @@ class VirtualMachine(object):
     # -------------------------
     # Jumps
     # -------------------------
+    # run_frame never calls these: quicken rewrites every jump to the inline
+    # JUMP/JUMP_IF_* kinds. They are kept only as part of the byte_* API.
     def byte_JUMP_FORWARD(self, jump):
         self.jump(jump)
 
@@ -474,7 +879,7 @@ class VirtualMachine(object):
     # Loops
     # -------------------------
     def byte_SETUP_LOOP(self, dest):
-        self.push_block('loop', dest)
+        self.push_block(BLOCK_LOOP, dest)
 
     def byte_GET_ITER(self):
         self.push(iter(self.pop()))
@@ -522,15 +927,26 @@ class VirtualMachine(object):
     # -------------------------
     # Modern Python bytecode instructions
     # -------------------------
+    def byte_NOP(self, arg=None):
+        pass
+
     def byte_RESUME(self, arg=None):
         pass
 
     def byte_CACHE(self, arg=None):
         pass
 
+    def byte_EXTENDED_ARG(self, arg=None):
+        # The decoder has already folded it into the next instruction's argument
+        pass
+
     def byte_PRECALL(self, arg=None):
         pass
 
+    def byte_END_FOR(self, arg=None):
+        # Never reached: an exhausted FOR_ITER already jumps past it
+        pass
+
     def byte_CALL(self, arg):
         argc = arg
         posargs = self.popn(argc)
@@ -561,59 +977,23 @@ class VirtualMachine(object):
             self.frame.stack[-1], self.frame.stack[-2] = self.frame.stack[-2], self.frame.stack[-1]
 
     def byte_LOAD_FAST_LOAD_FAST(self, arg):
-        # Load variables a and b (indices 0 and 1)
-        var1_name = self.frame.code_obj.co_varnames[0]  # 'a'
-        var2_name = self.frame.code_obj.co_varnames[1]  # 'b'
-        
-        val1 = self.frame.f_locals[var1_name]
-        val2 = self.frame.f_locals[var2_name]
-        
-        print(f"LOAD_FAST_LOAD_FAST: Loading {var1_name}={val1}, {var2_name}={val2}")
-        self.push(val1, val2)
-        print(f"Stack after LOAD_FAST_LOAD_FAST: {self.frame.stack}")
+        # Both local indices are packed into the argument: (first << 4) | second
+        self.byte_LOAD_FAST(arg >> 4)
+        self.byte_LOAD_FAST(arg & 15)
+
+    def byte_RETURN_CONST(self, const):
+        self.return_value = const
+        return "return"
 
     def byte_BINARY_OP(self, arg):
-        BINARY_OPS = {
-            0: operator.add,      # +
-            1: operator.and_,     # &
-            2: operator.floordiv, # //
-            3: operator.lshift,   # <<
-            4: operator.matmul,   # @
-            5: operator.mul,      # *
-            6: operator.mod,      # %
-            7: operator.or_,      # |
-            8: operator.pow,      # **
-            9: operator.rshift,   # >>
-            10: operator.sub,     # -
-            11: operator.truediv, # /
-            12: operator.xor,     # ^
-        }
-        
-        if len(self.frame.stack) < 2:
-            raise VirtualMachineError(f"Stack has only {len(self.frame.stack)} items, need 2 for binary operation")
-        
-        if arg in BINARY_OPS:
-            y, x = self.popn(2)  # y=5, x=2 when popped from [2, 5]
-            result = BINARY_OPS[arg](x, y)  # x + y = 2 + 5 = 7
-            print(f"BINARY_OP: {x} + {y} = {result}")  # Should show 2 + 5 = 7
-            self.push(result)
-        else:
+        if arg >= len(_BINOPS):
             raise VirtualMachineError(f"Unknown binary operation: {arg}")
+        x, y = self.pop2()
+        self.push(_BINOPS[arg](x, y))
 
 if __name__ == "__main__":
-    import sys
     print(f"Python version: {sys.version}")
-    
-    # Check opcode mappings - dis.opname is a list, not dict
-    print(f"Opcode 1 maps to: {dis.opname[1] if 1 < len(dis.opname) else 'UNKNOWN'}")
-    print(f"Opcode 149 maps to: {dis.opname[149] if 149 < len(dis.opname) else 'UNKNOWN'}")
-    print(f"Opcode 45 maps to: {dis.opname[45] if 45 < len(dis.opname) else 'UNKNOWN'}")
-    
-    # Let's find LOAD_FAST_LOAD_FAST
-    for i, name in enumerate(dis.opname):
-        if 'LOAD_FAST' in name:
-            print(f"Opcode {i}: {name}")
-    
+
     vm = VirtualMachine()
     print("Testing Virtual Machine...")
     
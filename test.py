@@ -1,4 +1,6 @@
-from byterun import VirtualMachine
+import sys
+
+from byterun import Function, VirtualMachine
 
 vm = VirtualMachine()
 
@@ -14,18 +16,103 @@ def test_subtract(x, y):
 def test_division(x, y):
     return x / y
 
+def test_less_than(a, b):
+    return a < b
+
+def test_while_loop(n):
+    total = 0
+    i = 0
+    while i < n:
+        total = total + i
+        i = i + 1
+    return total
+
+def test_for_range(n):
+    total = 0
+    for i in range(n):
+        total = total + i
+    return total
+
+def test_len(x):
+    return len(x)
+
+OFFSET = 100
+
+def test_global(x):
+    return x + OFFSET
+
+# Functions the VM calls through Function.__call__
+def add(a, b):
+    return a + b
+
+add_fn = Function('add', add.__code__, globals(), (), None, vm)
+
+def test_call(a, b):
+    return add_fn(a, b)
+
+def scale(x, factor):
+    return x * factor
+
+# Called with fewer arguments than it takes, so binding needs getcallargs
+scale_fn = Function('scale', scale.__code__, globals(), (10,), None, vm)
+
+def test_call_defaults(x):
+    return scale_fn(x)
+
+def outer(x):
+    return add_fn(x, x) + x
+
+outer_fn = Function('outer', outer.__code__, globals(), (), None, vm)
+
+# Each iteration reuses pooled frames for the two nested calls
+def test_nested_calls(n):
+    total = 0
+    i = 0
+    while i < n:
+        total = total + outer_fn(i)
+        i = i + 1
+    return total
+
 # Test cases
 tests = [
     (test_addition, {'a': 2, 'b': 5}, 7),
     (test_multiplication, {'x': 3, 'y': 4}, 12),
     (test_subtract, {'x': 10, 'y': 3}, 7),
     (test_division, {'x': 10, 'y': 2}, 5),
+    (test_less_than, {'a': 2, 'b': 5}, True),
+    (test_while_loop, {'n': 10}, 45),
+    (test_for_range, {'n': 10}, 45),
+    (test_len, {'x': [1, 2, 3]}, 3),
+    (test_global, {'x': 1}, 101),
+    (test_call, {'a': 2, 'b': 5}, 7),
+    (test_call_defaults, {'x': 3}, 30),
+    (test_nested_calls, {'n': 10}, 135),
+    # A missing argument leaves a local unbound inside the fused a + b
+    (test_addition, {'a': 2}, UnboundLocalError),
+    (test_addition, {'b': 5}, UnboundLocalError),
 ]
 
+failures = 0
 for fn, args, expected in tests:
     code = fn.__code__
     try:
         result = vm.run_code(code, callargs=args, global_names=globals())
-        print(f"{fn.__name__}({args}) = {result} (Expected: {expected})")
     except Exception as e:
-        print(f"Error running {fn.__name__}: {e}")
+        if isinstance(expected, type) and isinstance(e, expected):
+            print(f"{fn.__name__}({args}) raised {type(e).__name__} (Expected: {expected.__name__})")
+        else:
+            print(f"Error running {fn.__name__}: {e}")
+            failures += 1
+        continue
+    print(f"{fn.__name__}({args}) = {result} (Expected: {expected})")
+    if result != expected:
+        print(f"FAILED: {fn.__name__}")
+        failures += 1
+
+# Every frame was popped, and finished ones went back to the pool
+if vm.frames or not vm._frame_pool:
+    print("FAILED: frames left on the VM or none pooled")
+    failures += 1
+
+if failures:
+    sys.exit(f"{failures} test(s) failed")